@@ -11,6 +11,10 @@ if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable not set. Please set it in your .env file.")
 MODEL = "gpt-4o"
 MAX_COST = 100.0  # Maximum cost in USD
+MAX_WORKERS = 8  # Number of concurrent API requests
+RENDER_AHEAD = 2  # Number of leases rendered ahead of the API requests
+RENDER_PROCESSES = 4  # Processes that split long leases by page range, capped at the CPU count (None = one per CPU, 1 = in-process)
+MAX_RETRIES = 5  # Retries for rate-limited or failed API requests, with exponential backoff
 
 # Folder Configuration
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -19,15 +23,24 @@ PROMPT_FOLDER = os.path.join(BASE_DIR, "data", "prompts")
 OUTPUT_FOLDER = os.path.join(BASE_DIR, "output")
 EXCEPTIONS_FOLDER = os.path.join(BASE_DIR, "exceptions")
 
+# Page Rendering
+RENDER_DPI = 72  # Resolution lease pages are rendered at (72 = one pixel per PDF point)
+RENDER_GRAYSCALE = False  # Render pages in grayscale to shrink the images sent to the API
+IMAGE_FORMAT = "png"  # "png", or "jpeg"/"webp" for smaller (lossy) images of scanned leases
+IMAGE_QUALITY = 85  # JPEG/WebP quality (1-100)
+IMAGE_QUANTIZE = False  # Reduce PNG pages to a 16-color palette (lossy; much smaller for text scans)
+
 # Cost Estimation (approximate)
-# These values may need adjustment based on actual pricing
+# These values may need adjustment based on actual pricing.
+# Costs are whole nano-dollars (1e-9 USD) per token so totals add up exactly.
+NANO_DOLLARS_PER_USD = 1_000_000_000
 TOKEN_COSTS = {
     "gpt-4o": {
-        "input": 0.0000025,  # $2.50 per million tokens
-        "output": 0.00003,   # $30 per million tokens
+        "input": 2500,   # $2.50 per million tokens
+        "output": 30000, # $30 per million tokens
     },
     "o3-mini": {
-        "input": 0.0000011,  # $1.10 per million tokens
-        "output": 0.0000044  # $4.40 per million tokens
+        "input": 1100,   # $1.10 per million tokens
+        "output": 4400   # $4.40 per million tokens
     }
 }
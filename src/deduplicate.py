@@ -2,7 +2,8 @@
 """
 Deduplicate an aggregate markdown file that is already in lowercase and sorted by section.
 Each section starts with a header line beginning with "## " and is followed by bullet items.
-This script removes duplicate bullet lines within each section.
+This script removes duplicate bullet lines within each section, whether or not
+the duplicates are adjacent.
 Future enhancements may include fuzzy matching.
 Usage:
     python deduplicate.py <path_to_aggregate_file>
@@ -10,25 +11,32 @@ Usage:
 import sys
 import os
 
+# Buffer size for reading and writing aggregate files, and how many lines
+# to collect before handing them to the writer in one call
+BUFFER_SIZE = 1 << 20
+FLUSH_LINES = 4096
+
 def deduplicate_aggregate_file(input_filepath):
     temp_filepath = input_filepath + ".tmp"
-    with open(input_filepath, 'r', encoding='utf-8') as infile, open(temp_filepath, 'w', encoding='utf-8') as outfile:
-        last_bullet = None
+    with open(input_filepath, 'r', encoding='utf-8', buffering=BUFFER_SIZE) as infile, \
+            open(temp_filepath, 'w', encoding='utf-8', buffering=BUFFER_SIZE) as outfile:
+        pending = []
+        seen_bullets = set()
         for line in infile:
             stripped = line.rstrip("\n")
             if stripped.startswith("## "):
-                # New section header; write header and reset last bullet
-                outfile.write(line)
-                last_bullet = None
+                # New section header; forget the previous section's bullets
+                seen_bullets.clear()
             elif stripped.startswith("- "):
-                # Bullet line: skip if it is a duplicate of the previous bullet in this section
-                if stripped == last_bullet:
+                # Bullet line: skip if it already appeared anywhere in this section
+                if stripped in seen_bullets:
                     continue
-                else:
-                    outfile.write(line)
-                    last_bullet = stripped
-            else:
-                outfile.write(line)
+                seen_bullets.add(stripped)
+            pending.append(line)
+            if len(pending) >= FLUSH_LINES:
+                outfile.writelines(pending)
+                pending.clear()
+        outfile.writelines(pending)
     # Overwrite the original file with the deduplicated version
     os.replace(temp_filepath, input_filepath)
 
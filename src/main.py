@@ -37,6 +37,8 @@ def main():
                         help=f"Maximum cost in USD (default: ${config.MAX_COST})")
     parser.add_argument("--model", default=config.MODEL,
                         help=f"OpenAI model to use (default: {config.MODEL})")
+    parser.add_argument("--workers", type=int, default=config.MAX_WORKERS,
+                        help=f"Number of concurrent API requests (default: {config.MAX_WORKERS})")
     args = parser.parse_args()
     
     # Setup environment
@@ -47,6 +49,7 @@ def main():
     logging.info("Starting lease analysis process")
     logging.info(f"Using model: {args.model}")
     logging.info(f"Maximum cost: ${args.max_cost}")
+    logging.info(f"Concurrent requests: {args.workers}")
     logging.info(f"Lease folder: {config.LEASE_FOLDER}")
     logging.info(f"Prompt folder: {config.PROMPT_FOLDER}")
     
@@ -57,7 +60,8 @@ def main():
         output_folder=config.OUTPUT_FOLDER,
         exceptions_folder=config.EXCEPTIONS_FOLDER,
         model=args.model,
-        max_cost=args.max_cost
+        max_cost=args.max_cost,
+        max_workers=args.workers
     )
     
     try:
@@ -1,65 +1,88 @@
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 
-def aggregate_clause_folder(clause_folder_path, aggregate_output_path):
-    """
-    Process a clause folder by aggregating markdown content from each file,
-    excluding files that contain "I'm sorry, I can't assist with that."
-    and ignoring the "## STATUS" section.
-    The aggregated content for each section is appended as an unordered list.
-    """
-    # Dictionary to store aggregated content for each section header (e.g., "## CLAUSE")
-    sections = {}
+# Number of threads used to read markdown files within a clause folder
+READ_WORKERS = 16
 
-    # List all markdown files in the clause folder
-    for filename in os.listdir(clause_folder_path):
-        if filename.endswith(".md"):
-            file_path = os.path.join(clause_folder_path, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-            except Exception as e:
-                print(f"Error reading {file_path}: {e}")
-                continue
+# Buffer size for writing aggregated files
+WRITE_BUFFER_SIZE = 1 << 20
 
-            # Skip file if it contains the disallowed phrase
-            if "I'm sorry, I can't assist with that." in content:
-                continue
+# Model refusals always open the response, so only the start of a file is checked
+REFUSAL_PHRASE = "I'm sorry, I can't assist with that."
+REFUSAL_SCAN_CHARS = 1024
 
-            # Split content into sections using headers that start with "##"
-            parts = re.split(r'(^##\s+.*$)', content, flags=re.MULTILINE)
+# Patterns used while building the aggregated output, compiled once at import
+CHUNK_SIZE_RE = re.compile(r'(\d+)\s+tokens\s+with\s+a\s+(\d+)-token\s+overlap')
+LEADING_DASHES_RE = re.compile(r'^[-\s]+')
 
-            # If the content does not start with a header, skip the preamble
-            if parts and not parts[0].startswith("##"):
-                parts = parts[1:]
+def iter_sections(content):
+    """
+    Split markdown content into sections by scanning for "## " header lines.
+    Yields (header, body) pairs for each header, where body is the stripped
+    text up to the next header. Text before the first header is yielded with
+    a header of None.
+    """
+    if content.startswith("## "):
+        header_start = 0
+    else:
+        header_start = content.find("\n## ")
+        yield None, content[:header_start if header_start != -1 else len(content)].strip()
+        if header_start == -1:
+            return
+        header_start += 1
 
-            # Process sections in pairs: header and its content
-            for i in range(0, len(parts), 2):
-                header = parts[i].strip()
-                body = parts[i+1].strip() if i+1 < len(parts) else ""
-                # Skip the STATUS and ASSESSMENT sections
-                if header.upper() in ["## STATUS", "## ASSESSMENT"]:
-                    continue
-                # Initialize list for the section if not already present
-                if header not in sections:
-                    sections[header] = []
-                # Append this file's section content if it exists
-                if body:
-                    sections[header].append(body)
-
-    # Build aggregated markdown content in lowercase and sorted by section
-    output_lines = []
-    for header in sorted(sections.keys(), key=lambda h: h[3:].strip().lower() if h.startswith("## ") else h.lower()):
+    while True:
+        header_end = content.find("\n", header_start)
+        if header_end == -1:
+            yield content[header_start:].strip(), ""
+            return
+        next_header = content.find("\n## ", header_end)
+        if next_header == -1:
+            yield content[header_start:header_end].strip(), content[header_end + 1:].strip()
+            return
+        yield content[header_start:header_end].strip(), content[header_end + 1:next_header].strip()
+        header_start = next_header + 1
+
+def read_markdown_file(file_path):
+    """
+    Read a markdown file, skipping model refusals.
+    Returns (file_path, content), with content set to None if the file could
+    not be read or starts with the refusal phrase.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            head = f.read(REFUSAL_SCAN_CHARS)
+            if REFUSAL_PHRASE in head:
+                return file_path, None
+            return file_path, head + f.read()
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return file_path, None
+
+def iter_output_lines(sections):
+    """
+    Yield the aggregated markdown lines, in lowercase and sorted by section.
+    Sections are separated by a blank line; lines are yielded without newlines.
+    """
+    # Case-insensitive sort keys are computed once per header and item;
+    # casefold() is the Unicode-correct way to compare ignoring case
+    headers = [(h[3:].strip().casefold() if h.startswith("## ") else h.casefold(), h) for h in sections]
+    headers.sort()
+    for index, (_, header) in enumerate(headers):
+        if index:
+            yield ""  # blank line between sections
         lower_header = header.lower()
-        output_lines.append(lower_header)
-        output_lines.append("")  # blank line
-        if header.lower() == "## chunk size":
+        yield lower_header
+        yield ""  # blank line
+        if lower_header == "## chunk size":
             # Calculate average chunk size
             total_tokens = 0
             total_overlap = 0
             count = 0
             for item in sections[header]:
-                match = re.search(r'(\d+)\s+tokens\s+with\s+a\s+(\d+)-token\s+overlap', item)
+                match = CHUNK_SIZE_RE.search(item)
                 if match:
                     total_tokens += int(match.group(1))
                     total_overlap += int(match.group(2))
@@ -67,18 +90,52 @@ def aggregate_clause_folder(clause_folder_path, aggregate_output_path):
             if count > 0:
                 avg_tokens = total_tokens // count
                 avg_overlap = total_overlap // count
-                output_lines.append(f"recommend a chunk size of {avg_tokens} tokens with a {avg_overlap}-token overlap")
+                yield f"recommend a chunk size of {avg_tokens} tokens with a {avg_overlap}-token overlap"
         else:
-            for item in sorted(sections[header], key=lambda i: i.lower()):
-                sanitized_item = item.lower().strip()
-                sanitized_item = re.sub(r'^[-\s]+', '', sanitized_item)
-                sanitized_item = re.sub(r'^"+|"+$', '', sanitized_item).strip()
+            items = [(item.casefold(), item.lower()) for item in sections[header]]
+            items.sort()
+            for _, lower_item in items:
+                sanitized_item = lower_item.strip()
+                sanitized_item = LEADING_DASHES_RE.sub('', sanitized_item)
+                sanitized_item = sanitized_item.strip('"').strip()
                 if "n/a" in sanitized_item:
                     continue
-                output_lines.append(f"- {sanitized_item}")
-        output_lines.append("")  # blank line after each section
+                yield f"- {sanitized_item}"
+
+def aggregate_clause_folder(clause_folder_path, aggregate_output_path):
+    """
+    Process a clause folder by aggregating markdown content from each file,
+    excluding files that open with "I'm sorry, I can't assist with that."
+    and ignoring the "## STATUS" section.
+    The aggregated content for each section is appended as an unordered list.
+    """
+    # Dictionary to store aggregated content for each section header (e.g., "## CLAUSE")
+    sections = {}
+
+    # List all markdown files in the clause folder
+    with os.scandir(clause_folder_path) as entries:
+        file_paths = [e.path for e in entries if e.name.endswith(".md") and e.is_file()]
+
+    # Reads are latency-bound, so overlap them; parsing below stays single-threaded
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        contents = list(executor.map(read_markdown_file, file_paths))
+
+    for file_path, content in contents:
+        # Skip files that could not be read or are refusals
+        if content is None:
+            continue
+
+        for header, body in iter_sections(content):
+            # Skip the preamble and the STATUS and ASSESSMENT sections
+            if header is None or header.upper() in ["## STATUS", "## ASSESSMENT"]:
+                continue
+            # Initialize list for the section if not already present
+            if header not in sections:
+                sections[header] = []
+            # Append this file's section content if it exists
+            if body:
+                sections[header].append(body)
 
-    aggregated_content = "\n".join(output_lines)
     # Determine output file path based on the clause folder name
     aggregated_filename = os.path.basename(clause_folder_path) + ".md"
     aggregated_filepath = os.path.join(aggregate_output_path, aggregated_filename)
@@ -86,8 +143,8 @@ def aggregate_clause_folder(clause_folder_path, aggregate_output_path):
     # Ensure the aggregate output folder exists
     os.makedirs(aggregate_output_path, exist_ok=True)
     try:
-        with open(aggregated_filepath, 'w', encoding='utf-8') as f:
-            f.write(aggregated_content)
+        with open(aggregated_filepath, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+            f.writelines(line + "\n" for line in iter_output_lines(sections))
         print(f"Aggregated file created: {aggregated_filepath}")
     except Exception as e:
         print(f"Error writing aggregated file {aggregated_filepath}: {e}")
@@ -99,11 +156,16 @@ def main():
     os.makedirs(processed_output, exist_ok=True)
     
     # List clause folders: all directories in "output" excluding "processed", "summaries", and "aggregate"
-    for entry in os.listdir(base_output):
-        path = os.path.join(base_output, entry)
-        if os.path.isdir(path) and entry.lower() not in ["processed", "summaries", "aggregate"]:
-            print(f"Processing clause folder: {path}")
-            aggregate_clause_folder(path, aggregate_output)
+    clause_folders = []
+    with os.scandir(base_output) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.name.lower() not in ["processed", "summaries", "aggregate"]:
+                print(f"Processing clause folder: {entry.path}")
+                clause_folders.append(entry.path)
+
+    # Clause folders are independent, so aggregate them on separate processes
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(partial(aggregate_clause_folder, aggregate_output_path=aggregate_output), clause_folders))
 
 if __name__ == "__main__":
     main()
@@ -1,18 +1,28 @@
 # processor.py
+import io
 import os
 import logging
 import json
+import multiprocessing
 import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from datetime import datetime
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, InternalServerError, RateLimitError
 from . import config
-from .utils import is_pdf, convert_pdf_to_images
+from .utils import is_pdf, iter_pdf_pages_as_b64, encode_pdf_to_base64_into, close_cached_pdf, IMAGE_MIME_TYPES
 from .parser import main as aggregate_main
-import base64
+
+# orjson is an optional, faster drop-in for writing the JSON report
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 class LeaseProcessor:
     def __init__(self, lease_folder, prompt_folder, output_folder, exceptions_folder, 
-                 model="o3-mini", max_cost=500.0):
+                 model="o3-mini", max_cost=500.0, max_workers=8):
         """
         Initialize the lease processor.
         
@@ -23,6 +33,7 @@ class LeaseProcessor:
             exceptions_folder: Path to folder where error files will be moved
             model: OpenAI model to use
             max_cost: Maximum cost allowed for API calls (in USD)
+            max_workers: Number of API requests to run concurrently
         """
         self.lease_folder = lease_folder
         self.prompt_folder = prompt_folder
@@ -30,9 +41,17 @@ class LeaseProcessor:
         self.exceptions_folder = exceptions_folder
         self.model = model
         self.max_cost = max_cost
+        # The cost cap is compared in integer nano-dollars, so it is exact
+        self.max_cost_nano = round(max_cost * config.NANO_DOLLARS_PER_USD)
+        self.max_workers = max_workers
         
-        # Initialize OpenAI client
-        self.client = OpenAI(api_key=config.OPENAI_API_KEY)
+        # Initialize OpenAI client; it retries rate limits, 5xx responses and
+        # connection errors itself, with exponential backoff and jitter
+        self.client = OpenAI(api_key=config.OPENAI_API_KEY, max_retries=config.MAX_RETRIES)
+
+        # Resolved once here rather than on every API call
+        self._create_completion = self.client.chat.completions.create
+        self._token_costs = config.TOKEN_COSTS.get(model, config.TOKEN_COSTS["gpt-4o"])
         
         # Stats tracking
         self.stats = {
@@ -43,19 +62,38 @@ class LeaseProcessor:
             "errors": 0,
             "total_tokens_input": 0,
             "total_tokens_output": 0,
-            "estimated_cost": 0.0,
+            "estimated_cost_nano": 0,
             "error_details": []
         }
+        # API calls run on worker threads, so every stats update goes through this lock
+        self._stats_lock = threading.Lock()
+        # Set, under _stats_lock, by the API call that takes the total past the cost
+        # limit; workers check it before every call so no job is sent after that
+        self._stop_event = threading.Event()
+
+        # Leases are rendered on a separate pool, a few ahead of the API calls.
+        # Each future holds one lease's encoded pages, shared by all of its prompts.
+        self._render_executor = None
+        self._render_order = []
+        self._render_index = {}
+        self._render_futures = {}
+        self._next_render = 0
+        self._render_lock = threading.Lock()
+        # Process pool shared by every render in a run, for leases long enough to split
+        self._page_executor = None
+        self._render_processes = 1
     
     def get_lease_files(self):
         """Get all PDF files from the lease folder."""
-        return [f for f in os.listdir(self.lease_folder) 
-                if f.lower().endswith('.pdf')]
+        with os.scandir(self.lease_folder) as entries:
+            return [e.name for e in entries
+                    if e.is_file() and is_pdf(e.name)]
     
     def get_prompt_files(self):
         """Get all prompt files from the prompt folder."""
-        return [f for f in os.listdir(self.prompt_folder) 
-                if f.lower().endswith(('.txt', '.md')) and f != 'prompt-template.md']
+        with os.scandir(self.prompt_folder) as entries:
+            return [e.name for e in entries
+                    if e.is_file() and e.name.lower().endswith(('.txt', '.md')) and e.name != 'prompt-template.md']
     
     def read_prompt_file(self, file_name):
         """
@@ -82,38 +120,103 @@ class LeaseProcessor:
             
         return content, output_name
     
-    def call_openai_api(self, prompt, lease_path):
+    def build_user_content(self, lease_path):
         """
-        Make an API call to OpenAI with the prompt and lease file.
+        Convert a lease file into the user message content sent to the API.
         
         Returns:
-            dict: API response or error information
+            list: image_url message parts, one per page for PDFs
         """
-        try:
-            lease_full_path = os.path.join(self.lease_folder, lease_path)
-            if is_pdf(lease_full_path):
-                images = convert_pdf_to_images(lease_full_path)
-                image_messages = []
-                for image_bytes in images:
-                    image_b64 = base64.b64encode(image_bytes).decode('utf-8')
-                    image_messages.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{image_b64}"
-                        }
-                    })
-                user_content = image_messages
-            else:
-                with open(lease_full_path, "rb") as file:
-                    pdf_b64 = base64.b64encode(file.read()).decode('utf-8')
-                user_content = [{
+        lease_full_path = os.path.join(self.lease_folder, lease_path)
+        if is_pdf(lease_full_path):
+            # Pages are encoded as they are rendered, so only one raw image is held at a time
+            url_prefix = f"data:{IMAGE_MIME_TYPES[config.IMAGE_FORMAT]};base64,"
+            image_messages = []
+            pages = iter_pdf_pages_as_b64(lease_full_path, dpi=config.RENDER_DPI, grayscale=config.RENDER_GRAYSCALE,
+                                          image_format=config.IMAGE_FORMAT, quality=config.IMAGE_QUALITY,
+                                          quantize=config.IMAGE_QUANTIZE, workers=self._render_processes,
+                                          executor=self._page_executor)
+            for _, image_b64 in pages:
+                image_messages.append({
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:application/pdf;base64,{pdf_b64}"
+                        "url": url_prefix + image_b64
                     }
-                }]
+                })
+            return image_messages
 
-            response = self.client.chat.completions.create(
+        # Stream the encoding straight after the data URL prefix so the raw
+        # file and a separate base64 copy are never held at the same time
+        pdf_url = io.BytesIO()
+        pdf_url.write(b"data:application/pdf;base64,")
+        encode_pdf_to_base64_into(lease_full_path, pdf_url)
+        return [{
+            "type": "image_url",
+            "image_url": {
+                "url": pdf_url.getvalue().decode('ascii')
+            }
+        }]
+
+    def get_user_content(self, lease_path):
+        """
+        Return the user message content for a lease, waiting for it to be rendered.
+        
+        Requesting a lease also queues rendering of the next config.RENDER_AHEAD
+        leases, so their pages are ready by the time their prompts start. The
+        result is kept until finish_lease() releases it.
+        """
+        with self._render_lock:
+            last = self._render_index[lease_path] + config.RENDER_AHEAD
+            while self._next_render <= last and self._next_render < len(self._render_order):
+                lease_file = self._render_order[self._next_render]
+                self._render_futures[lease_file] = self._render_executor.submit(self.build_user_content, lease_file)
+                self._next_render += 1
+            render = self._render_futures[lease_path]
+        return render.result()
+
+    def release_user_content(self, lease_path):
+        """Drop the rendered user message content for a lease."""
+        with self._render_lock:
+            self._render_futures.pop(lease_path, None)
+
+    def run_prompt(self, prompt, lease_path, prompt_file, prompt_name):
+        """
+        Send a prompt for a lease once the lease has been rendered.
+        prompt_file and prompt_name are only used for logging.
+        
+        Returns:
+            dict: API response or error information. Jobs reached after the cost
+            limit was passed return {"success": False, "stopped": True} without an API call.
+        """
+        stopped = {"success": False, "stopped": True, "error": "Cost limit reached"}
+        try:
+            user_content = self.get_user_content(lease_path)
+        except Exception as e:
+            # Rendering is cancelled once the cost limit stops processing
+            if self._stop_event.is_set():
+                return stopped
+            # Every prompt for the lease gets this same error from the shared render,
+            # so it is logged and counted once, by process()
+            return {
+                "success": False,
+                "error": str(e),
+                "render_failed": True
+            }
+        if self._stop_event.is_set():
+            return stopped
+        logging.info("Processing lease '%s' with prompt '%s' (Output name: %s)", lease_path, prompt_file, prompt_name)
+        return self.call_openai_api(prompt, lease_path, user_content)
+
+    def call_openai_api(self, prompt, lease_path, user_content):
+        """
+        Make an API call to OpenAI with the prompt and rendered lease content.
+        
+        Returns:
+            dict: API response or error information. The response that takes the
+            total past the cost limit is still returned, with "cost_limit" set.
+        """
+        try:
+            response = self._create_completion(
                 model=self.model,
                 messages=[
                     {
@@ -128,24 +231,27 @@ class LeaseProcessor:
                 temperature=0.2  # Lower temperature for more deterministic outputs
             )
 
-            # Update token usage
-            usage = response.usage
-            self.stats["total_tokens_input"] += usage.prompt_tokens
-            self.stats["total_tokens_output"] += usage.completion_tokens
-
             # Calculate estimated cost
-            token_costs = config.TOKEN_COSTS.get(self.model, config.TOKEN_COSTS["gpt-4o"])
-            input_cost = usage.prompt_tokens * token_costs["input"]
-            output_cost = usage.completion_tokens * token_costs["output"]
-            current_cost = input_cost + output_cost
-
-            self.stats["estimated_cost"] += current_cost
+            usage = response.usage
+            input_cost = usage.prompt_tokens * self._token_costs["input"]
+            output_cost = usage.completion_tokens * self._token_costs["output"]
+            current_cost_nano = input_cost + output_cost
 
-            if self.stats["estimated_cost"] > self.max_cost:
-                raise Exception(f"Cost limit exceeded: ${self.stats['estimated_cost']:.2f} > ${self.max_cost:.2f}")
+            # Update token usage
+            with self._stats_lock:
+                self.stats["total_tokens_input"] += usage.prompt_tokens
+                self.stats["total_tokens_output"] += usage.completion_tokens
+                self.stats["estimated_cost_nano"] += current_cost_nano
+                total_cost_nano = self.stats["estimated_cost_nano"]
+                # The call that crosses the limit stops further calls, but it has
+                # been paid for, so its response is kept like the ones still in flight
+                crossed_limit = total_cost_nano > self.max_cost_nano and not self._stop_event.is_set()
+                if crossed_limit:
+                    self._stop_event.set()
 
             return {
                 "success": True,
+                "cost_limit": crossed_limit,
                 "content": response.choices[0].message.content,
                 "model": response.model,
                 "usage": {
@@ -158,7 +264,9 @@ class LeaseProcessor:
             logging.error(f"API call failed for {lease_path}: {str(e)}")
             return {
                 "success": False,
-                "error": str(e)
+                "error": str(e),
+                # Still failing after the client's retries, but likely to work on a later run
+                "retriable": isinstance(e, (APIConnectionError, InternalServerError, RateLimitError))
             }
     
     def save_output(self, prompt_name, lease_name, response):
@@ -201,7 +309,7 @@ class LeaseProcessor:
         
         try:
             shutil.move(source_path, dest_path)
-            logging.info(f"Moved {lease_file} to exceptions folder")
+            logging.info("Moved %s to exceptions folder", lease_file)
             return True
         except Exception as e:
             logging.error(f"Failed to move {lease_file} to exceptions folder: {e}")
@@ -213,12 +321,45 @@ class LeaseProcessor:
         dest_path = os.path.join(self.output_folder, "processed", lease_file)
         try:
             shutil.move(source_path, dest_path)
-            logging.info(f"Moved {lease_file} to processed folder")
+            logging.info("Moved %s to processed folder", lease_file)
             return True
         except Exception as e:
             logging.error(f"Failed to move {lease_file} to processed folder: {e}")
             return False
     
+    def iter_jobs(self, lease_files, prompts):
+        """
+        Yield every (lease, prompt) combination that needs an API call.
+
+        Args:
+            lease_files: Lease file names
+            prompts: (prompt_file, prompt_content, prompt_name) tuples
+
+        Yields:
+            tuple: (lease_file, prompt_file, prompt_content, prompt_name)
+        """
+        for lease_file in lease_files:
+            for prompt_file, prompt_content, prompt_name in prompts:
+                yield lease_file, prompt_file, prompt_content, prompt_name
+
+    def finish_lease(self, lease_file, failed, deferred=False):
+        """
+        Move a lease out of the lease folder once all of its prompts are done.
+        
+        Leases that failed permanently go to the exceptions folder. Leases that
+        only hit transient API errors (deferred) stay put so the next run retries them.
+        """
+        self.release_user_content(lease_file)
+        # Let go of the parsed PDF so the file can be moved
+        close_cached_pdf(os.path.join(self.lease_folder, lease_file))
+        if failed:
+            self.move_to_exceptions(lease_file)
+        elif deferred:
+            logging.warning("Leaving %s in the lease folder to retry on the next run", lease_file)
+        else:
+            self.move_to_processed(lease_file)
+            logging.info("Completed processing for %s, moved to processed folder", lease_file)
+
     def process(self):
         """Process all lease files with all prompts."""
         self.processing_start_time = datetime.now()
@@ -237,42 +378,114 @@ class LeaseProcessor:
             return
         
         logging.info(f"Found {len(lease_files)} lease files and {len(prompt_files)} prompt files")
-                
-        for lease_file in lease_files:
-            lease_name = os.path.splitext(lease_file)[0]
-            lease_success = True
-            for prompt_file in prompt_files:
-                prompt_content, prompt_name = self.read_prompt_file(prompt_file)
-                logging.info(f"Processing lease '{lease_file}' with prompt '{prompt_file}' (Output name: {prompt_name})")
-                response = self.call_openai_api(prompt_content, lease_file)
-                self.stats["processed_combinations"] += 1
-                if response["success"]:
-                    output_path = self.save_output(prompt_name, lease_name, response)
-                    if output_path:
-                        logging.info(f"Saved output to {output_path}")
-                        self.stats["successful"] += 1
+
+        # Prompts are the same for every lease, so read each file only once
+        prompts = [(prompt_file, *self.read_prompt_file(prompt_file)) for prompt_file in prompt_files]
+
+        # A lease is only moved once every one of its API calls has finished,
+        # so no worker is still reading the file when it leaves the lease folder
+        remaining = {lease_file: len(prompt_files) for lease_file in lease_files}
+        lease_futures = {lease_file: [] for lease_file in lease_files}
+        failed_leases = set()
+        deferred_leases = set()
+
+        # Long leases are split across one process pool that lasts the whole run;
+        # starting a pool per lease costs more than rendering a typical lease
+        cpu_count = os.cpu_count() or 1
+        # Each spawned worker re-imports the program, so the default pool is kept small
+        self._render_processes = min(config.RENDER_PROCESSES or cpu_count, cpu_count)
+        if self._render_processes > 1:
+            page_pool = ProcessPoolExecutor(max_workers=self._render_processes,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        else:
+            page_pool = nullcontext()
+
+        # Rendering is CPU-bound and the API calls are network-bound, so the
+        # next leases are rendered while the current ones are being sent
+        with page_pool as page_executor, \
+                ThreadPoolExecutor(max_workers=config.RENDER_AHEAD) as render_executor, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            self._page_executor = page_executor
+            self._render_executor = render_executor
+            self._render_order = lease_files
+            self._render_index = {lease_file: i for i, lease_file in enumerate(lease_files)}
+            futures = {}
+            for lease_file, prompt_file, prompt_content, prompt_name in self.iter_jobs(lease_files, prompts):
+                future = executor.submit(self.run_prompt, prompt_content, lease_file, prompt_file, prompt_name)
+                futures[future] = (lease_file, prompt_file, prompt_name)
+                lease_futures[lease_file].append(future)
+
+            stopping = False
+            for future in as_completed(futures):
+                lease_file, prompt_file, prompt_name = futures[future]
+                lease_name = os.path.splitext(lease_file)[0]
+
+                response = None if future.cancelled() else future.result()
+                if response is not None and response.get("render_failed") and lease_file in failed_leases:
+                    # The other prompts of a lease that failed to render, already recorded once
+                    pass
+                elif response is None or response.get("stopped"):
+                    # Jobs skipped after a failure still count towards finishing their lease;
+                    # jobs skipped at the cost limit leave it in place for the next run
+                    if lease_file not in failed_leases and lease_file not in deferred_leases:
+                        continue
                 else:
-                    self.stats["errors"] += 1
-                    self.stats["error_details"].append({
-                        "lease": lease_file,
-                        "prompt": prompt_file,
-                        "error": response["error"]
-                    })
-                    self.save_output(prompt_name, lease_name, response)
-                    self.move_to_exceptions(lease_file)
-                    lease_success = False
-                    break
+                    with self._stats_lock:
+                        self.stats["processed_combinations"] += 1
+                    if response["success"]:
+                        output_path = self.save_output(prompt_name, lease_name, response)
+                        if output_path:
+                            logging.info("Saved output to %s", output_path)
+                            with self._stats_lock:
+                                self.stats["successful"] += 1
+                    else:
+                        if response.get("render_failed"):
+                            logging.error(f"Failed to prepare {lease_file}: {response['error']}")
+                        with self._stats_lock:
+                            self.stats["errors"] += 1
+                            self.stats["error_details"].append({
+                                "lease": lease_file,
+                                "prompt": prompt_file,
+                                "error": response["error"]
+                            })
+                        self.save_output(prompt_name, lease_name, response)
+                        if response.get("retriable"):
+                            deferred_leases.add(lease_file)
+                        else:
+                            failed_leases.add(lease_file)
+                        # Skip the prompts for this lease that have not started yet
+                        for pending in lease_futures[lease_file]:
+                            pending.cancel()
 
-                logging.info(f"Current estimated cost: ${self.stats['estimated_cost']:.4f}")
+                    with self._stats_lock:
+                        estimated_cost_nano = self.stats["estimated_cost_nano"]
+                    estimated_cost = estimated_cost_nano / config.NANO_DOLLARS_PER_USD
+                    logging.info("Current estimated cost: $%.4f", estimated_cost)
 
-                if self.stats["estimated_cost"] > self.max_cost:
-                    logging.warning(f"Cost limit reached (${self.stats['estimated_cost']:.2f}). Stopping processing.")
-                    return
+                    if not stopping and estimated_cost_nano > self.max_cost_nano:
+                        logging.warning(f"Cost limit reached (${estimated_cost:.2f}). Stopping processing.")
+                        stopping = True
+                        # Cancel the queued API calls first, without waiting, so no worker
+                        # picks up another job while the renders in progress finish.
+                        # The futures are cancelled one by one rather than through
+                        # shutdown(cancel_futures=True), which never reports them to
+                        # as_completed(); the loop carries on to save the calls that
+                        # were already running.
+                        for pending in futures:
+                            pending.cancel()
+                        render_executor.shutdown(wait=False, cancel_futures=True)
+                        if page_executor is not None:
+                            page_executor.shutdown(wait=False, cancel_futures=True)
+                        with self._render_lock:
+                            self._render_futures.clear()
+
+                remaining[lease_file] -= 1
+                if remaining[lease_file] == 0:
+                    self.finish_lease(lease_file, lease_file in failed_leases, lease_file in deferred_leases)
+
+        if stopping:
+            return
 
-            if lease_success:
-                self.move_to_processed(lease_file)
-                logging.info(f"Completed processing for {lease_file}, moved to processed folder")
-        
         # Run aggregation after processing
         aggregate_main()
         logging.info("Aggregation completed.")
@@ -301,7 +514,7 @@ class LeaseProcessor:
                 "total_tokens_input": self.stats["total_tokens_input"],
                 "total_tokens_output": self.stats["total_tokens_output"],
                 "total_tokens": self.stats["total_tokens_input"] + self.stats["total_tokens_output"],
-                "estimated_cost": f"${self.stats['estimated_cost']:.4f}"
+                "estimated_cost": f"${self.stats['estimated_cost_nano'] / config.NANO_DOLLARS_PER_USD:.4f}"
             },
             "errors": self.stats["error_details"] if self.stats["errors"] > 0 else []
         }
@@ -312,8 +525,12 @@ class LeaseProcessor:
             f"summary_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         )
         os.makedirs(os.path.dirname(report_path), exist_ok=True)
-        with open(report_path, 'w', encoding='utf-8') as f:
-            json.dump(report, f, indent=2)
+        if orjson is not None:
+            with open(report_path, 'wb') as f:
+                f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        else:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
         # Also create a markdown version
         md_report_path = os.path.join(
             self.output_folder,
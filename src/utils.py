@@ -1,15 +1,121 @@
-import base64
+import asyncio
+import io
+import logging
+import math
+import mmap
+import multiprocessing
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 import fitz
+from PIL import Image
+
+# Documents shorter than this render in-process even when a pool is available,
+# so short leases are not split across workers a page or two at a time
+PARALLEL_MIN_PAGES = 16
+
+# Largest pixmap a single page may render to; bigger pages (drawings, oversized
+# exhibits) are scaled down to fit rather than allocating one huge buffer
+MAX_PAGE_PIXMAP_BYTES = 32 << 20
+
+# Number of parsed documents open_pdf_cached() keeps open, least recently used first out
+PDF_CACHE_SIZE = 8
+
+# Page image formats iter_pdf_images() can produce, with their MIME types
+IMAGE_MIME_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+# pybase64 is an optional SIMD-accelerated drop-in for the standard library encoder.
+# Without it, call binascii directly rather than through the base64 module wrapper.
+try:
+    from pybase64 import b64encode
+except ImportError:
+    from binascii import b2a_base64
+    b64encode = partial(b2a_base64, newline=False)
+
+# Just under 64 KiB, and a multiple of 3 so base64 chunks can be concatenated
+BASE64_CHUNK_SIZE = 3 * 21845
+
+_pdf_cache = OrderedDict()
+_pdf_cache_lock = threading.Lock()
+
+def open_pdf_cached(pdf_path):
+    """
+    Open a PDF with PyMuPDF, reusing the parsed document on repeat calls.
+    Entries are keyed by path, modification time and size, so a file that
+    changes on disk is parsed again. Callers must not close the document;
+    use close_cached_pdf() when the file is done with.
+    """
+    stat = os.stat(pdf_path)
+    key = (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+    with _pdf_cache_lock:
+        doc = _pdf_cache.get(key)
+        if doc is not None:
+            _pdf_cache.move_to_end(key)
+            return doc
+    doc = fitz.open(pdf_path)
+    with _pdf_cache_lock:
+        _pdf_cache[key] = doc
+        while len(_pdf_cache) > PDF_CACHE_SIZE:
+            # Not closed here, since another thread may still be rendering from it;
+            # the document closes once the last reference goes away
+            _pdf_cache.popitem(last=False)
+    return doc
+
+def close_cached_pdf(pdf_path):
+    """
+    Close and forget any cached documents for a PDF file. Call this before
+    moving or deleting the file, since Windows cannot move a file held open.
+    """
+    path = os.path.abspath(pdf_path)
+    with _pdf_cache_lock:
+        keys = [key for key in _pdf_cache if key[0] == path]
+        docs = [_pdf_cache.pop(key) for key in keys]
+    for doc in docs:
+        doc.close()
 
 def is_pdf(file_path):
-    """Check if a file is a PDF."""
-    return file_path.lower().endswith('.pdf')
+    """
+    Check if a file is a PDF.
+    Accepts str, bytes or path-like objects; only the last four characters are
+    lowercased, rather than a copy of the whole path.
+    """
+    return os.fspath(file_path)[-4:].lower() in ('.pdf', b'.pdf')
 
-def encode_pdf_to_base64(file_path):
-    """Convert a PDF file to base64 encoding."""
+def encode_pdf_to_base64_into(file_path, writer, chunk_size=BASE64_CHUNK_SIZE):
+    """
+    Stream the base64 encoding of a PDF file into a writable binary stream.
+    The file is memory-mapped and encoded chunk by chunk straight from the
+    page cache, so its bytes are never copied onto the Python heap.
+    :param file_path: Path to the PDF file.
+    :param writer: Binary file-like object; receives ASCII base64 bytes.
+    :param chunk_size: Bytes encoded per chunk; must be a multiple of 3 so every
+        chunk except the last encodes without padding.
+    :return: The writer, for chaining.
+    """
+    if chunk_size % 3:
+        raise ValueError(f"chunk_size must be a multiple of 3, got {chunk_size}")
     with open(file_path, "rb") as pdf_file:
-        return base64.b64encode(pdf_file.read()).decode('utf-8')
+        # Empty files cannot be mapped, and encode to nothing anyway
+        if not os.fstat(pdf_file.fileno()).st_size:
+            return writer
+        with mmap.mmap(pdf_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for start in range(0, len(view), chunk_size):
+                    writer.write(b64encode(view[start:start + chunk_size]))
+    return writer
+
+def encode_pdf_to_base64(file_path, chunk_size=BASE64_CHUNK_SIZE):
+    """Convert a PDF file to base64 encoding."""
+    return encode_pdf_to_base64_into(file_path, io.BytesIO(), chunk_size).getvalue().decode('ascii')
 
 def create_folder_structure():
     """Create the basic folder structure for the project."""
@@ -21,20 +127,183 @@ def create_folder_structure():
         "logs"
     ]
     
-    for folder in folders:
+    # Only touch folders that are missing, and report them in one message
+    missing = [folder for folder in folders if not os.path.isdir(folder)]
+    for folder in missing:
         os.makedirs(folder, exist_ok=True)
-        print(f"Created folder: {folder}")
+    if missing:
+        logging.info("Created folders: %s", ", ".join(missing))
 
-def convert_pdf_to_images(pdf_path):
+def _encode_quantized_png(pix, colors=16):
+    """Encode a pixmap as a palette PNG of at most `colors` colors (4-bit for 16)."""
+    mode = "L" if pix.n == 1 else "RGB"
+    image = Image.frombytes(mode, (pix.width, pix.height), pix.samples_mv)
+    buffer = io.BytesIO()
+    image.quantize(colors=colors, method=Image.Quantize.MEDIANCUT).save(buffer, "PNG")
+    return buffer.getvalue()
+
+def _render_settings(dpi, grayscale, image_format, quality, quantize=False):
+    """
+    Return the (matrix, colorspace, encode) triple used to render every page
+    of a document, where encode turns a pixmap into image bytes.
     """
-    Convert all pages of a PDF file to in-memory PNG images using PyMuPDF.
+    zoom = dpi / 72  # PDF user space is 72 points per inch
+    if image_format == "jpeg":
+        encode = partial(fitz.Pixmap.tobytes, output="jpeg", jpg_quality=quality)
+    elif image_format == "webp":
+        # MuPDF has no WebP encoder, so this goes through Pillow
+        encode = partial(fitz.Pixmap.pil_tobytes, format="WEBP", quality=quality)
+    elif quantize:
+        encode = _encode_quantized_png
+    else:
+        encode = partial(fitz.Pixmap.tobytes, output="png")
+    return fitz.Matrix(zoom, zoom), fitz.csGRAY if grayscale else fitz.csRGB, encode
+
+def _render_pixmap(page, matrix, colorspace):
+    """Render a single page to a pixmap, scaling it down if it would exceed MAX_PAGE_PIXMAP_BYTES."""
+    rect = page.rect * matrix
+    pixmap_bytes = rect.width * rect.height * colorspace.n
+    if pixmap_bytes > MAX_PAGE_PIXMAP_BYTES:
+        scale = math.sqrt(MAX_PAGE_PIXMAP_BYTES / pixmap_bytes)
+        matrix = matrix * fitz.Matrix(scale, scale)
+    return page.get_pixmap(matrix=matrix, colorspace=colorspace, alpha=False)
+
+def _render_page(page, matrix, colorspace, encode):
+    """Render a single page to encoded image bytes."""
+    return encode(_render_pixmap(page, matrix, colorspace))
+
+def _render_page_range(pdf_path, start, stop, dpi, grayscale, image_format, quality, quantize):
+    """Render pages [start, stop) of a PDF to image bytes; runs in a worker process."""
+    # Not cached: pool workers can outlive the file's stay in the lease folder,
+    # and close_cached_pdf() in the parent cannot release their handles
+    with fitz.open(pdf_path) as doc:
+        matrix, colorspace, encode = _render_settings(dpi, grayscale, image_format, quality, quantize)
+        return [_render_page(doc[number], matrix, colorspace, encode)
+                for number in range(start, stop)]
+
+def iter_pdf_images(pdf_path, workers=None, dpi=72, grayscale=False, image_format="png", quality=85,
+                    quantize=False, executor=None):
+    """
+    Yield each page of a PDF file as in-memory image data, in page order.
+    Pages are produced one at a time, so callers that consume them as they
+    arrive never hold every page at once.
+    MuPDF renders one page at a time per process, so long documents are split
+    into contiguous page ranges rendered by separate worker processes.
     :param pdf_path: Path to the PDF file.
-    :return: A list of bytes objects, each containing PNG image data for a page.
+    :param workers: Number of page ranges to split the document into; defaults to
+        the CPU count with an executor and to 1 (in-process) without one.
+        Documents shorter than PARALLEL_MIN_PAGES always render in-process.
+    :param dpi: Render resolution; 72 renders one pixel per PDF point.
+        Pages that would exceed MAX_PAGE_PIXMAP_BYTES are rendered at a lower resolution.
+    :param grayscale: Render 8-bit grayscale instead of RGB, which is a third
+        of the samples to encode and is usually enough for reading text.
+    :param image_format: One of IMAGE_MIME_TYPES. JPEG and WebP are lossy but
+        much smaller than PNG for scanned, photographic pages.
+    :param quality: Encoder quality for JPEG and WebP (1-100); ignored for PNG.
+    :param quantize: Reduce PNG pages to a 16-color palette. Lossy, but near-bitonal
+        scans of text come out several times smaller. Ignored for JPEG and WebP.
+    :param executor: A spawn-context ProcessPoolExecutor to render page ranges on.
+        Callers rendering many documents should pass one long-lived pool; without
+        it, workers > 1 starts a new pool for this document.
+    :return: A generator of bytes objects, each containing one page's image data.
     """
-    doc = fitz.open(pdf_path)
-    images = []
+    if image_format not in IMAGE_MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    doc = open_pdf_cached(pdf_path)
+    page_count = doc.page_count
+    if workers is None:
+        workers = (os.cpu_count() or 1) if executor is not None else 1
+    workers = min(workers, page_count)
+    if workers <= 1 or page_count < PARALLEL_MIN_PAGES:
+        matrix, colorspace, encode = _render_settings(dpi, grayscale, image_format, quality, quantize)
+        for page in doc:
+            # The page's raw samples are freed before the next page is rendered
+            yield _render_page(page, matrix, colorspace, encode)
+        return
+
+    # Each worker opens its own copy of the document. Spawn rather than fork,
+    # since this is called from the processor's worker threads.
+    step = math.ceil(page_count / workers)
+    starts = range(0, page_count, step)
+    stops = [min(start + step, page_count) for start in starts]
+    render_range = partial(_render_page_range, pdf_path, dpi=dpi, grayscale=grayscale,
+                           image_format=image_format, quality=quality, quantize=quantize)
+    if executor is None:
+        pool = ProcessPoolExecutor(max_workers=len(starts), mp_context=multiprocessing.get_context("spawn"))
+    else:
+        pool = nullcontext(executor)
+    with pool as executor:
+        for page_images in executor.map(render_range, starts, stops):
+            yield from page_images
+
+def convert_pdf_to_images(pdf_path, workers=None, dpi=72, grayscale=False, image_format="png", quality=85,
+                          quantize=False, executor=None):
+    """
+    Convert all pages of a PDF file to in-memory images using PyMuPDF.
+    Takes the same options as iter_pdf_images().
+    :param pdf_path: Path to the PDF file.
+    :return: A list of bytes objects, each containing one page's image data.
+    """
+    return list(iter_pdf_images(pdf_path, workers, dpi, grayscale, image_format, quality, quantize, executor))
+
+def iter_pdf_samples(pdf_path, dpi=72, grayscale=False):
+    """
+    Yield each page of a PDF file as raw, unencoded pixels, in page order.
+    For consumers that take raw RGB or grayscale samples, this skips the
+    image encode (and the receiver's decode) entirely. Pages render in-process.
+    :param pdf_path: Path to the PDF file.
+    :param dpi: Render resolution, as for iter_pdf_images().
+    :param grayscale: Yield one sample per pixel instead of three.
+    :return: A generator of (width, height, samples) tuples, where samples is
+        bytes of row-major pixels with no padding.
+    """
+    doc = open_pdf_cached(pdf_path)
+    matrix, colorspace, _ = _render_settings(dpi, grayscale, "png", None)
     for page in doc:
-        pix = page.get_pixmap()
-        image_bytes = pix.tobytes("png")
-        images.append(image_bytes)
-    return images
+        pix = _render_pixmap(page, matrix, colorspace)
+        yield pix.width, pix.height, bytes(pix.samples_mv)
+
+def iter_pdf_pages_as_b64(pdf_path, **render_options):
+    """
+    Yield (page_number, base64_str) for each page of a PDF file, in page order.
+    Each page is encoded as soon as it is rendered and its image bytes are
+    dropped before the next page renders, so only one page is held at a time.
+    :param pdf_path: Path to the PDF file.
+    :param render_options: Passed through to iter_pdf_images().
+    :return: A generator of (page_number, base64_str) tuples, numbered from 0.
+    """
+    for page_number, image_bytes in enumerate(iter_pdf_images(pdf_path, **render_options)):
+        image_b64 = b64encode(image_bytes).decode('ascii')
+        del image_bytes
+        yield page_number, image_b64
+
+async def process_batch(file_paths, max_concurrency=8, **render_options):
+    """
+    Prepare a batch of lease files concurrently, overlapping disk reads with rendering.
+    PDFs are rendered with convert_pdf_to_images() on worker processes, since
+    MuPDF holds the GIL; any other file is base64-encoded on a thread.
+    :param file_paths: Paths to the files to prepare.
+    :param max_concurrency: Maximum number of files in flight at once.
+    :param render_options: Passed through to convert_pdf_to_images().
+    :return: One result per path, in input order: a list of page images for
+        PDFs, or the file's base64 string otherwise. A file that could not be
+        read or rendered gets the exception it raised in its place, so one bad
+        file does not lose the rest of the batch.
+    """
+    if not file_paths:
+        return []
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # Each file already gets its own process, so don't let it start a pool of its own
+    render = partial(convert_pdf_to_images, workers=1, **render_options)
+    process_count = min(max_concurrency, len(file_paths), os.cpu_count() or 1)
+
+    with ProcessPoolExecutor(max_workers=process_count, mp_context=multiprocessing.get_context("spawn")) as process_pool, \
+            ThreadPoolExecutor(max_workers=max_concurrency) as thread_pool:
+        async def prepare(file_path):
+            async with semaphore:
+                if is_pdf(file_path):
+                    return await loop.run_in_executor(process_pool, render, file_path)
+                return await loop.run_in_executor(thread_pool, encode_pdf_to_base64, file_path)
+
+        return await asyncio.gather(*(prepare(file_path) for file_path in file_paths), return_exceptions=True)